@@ -2,9 +2,16 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
+import pydeck as pdk
+import pyarrow as pa
+from numba import njit
 from datetime import datetime
 import itertools
+import hashlib
+import tempfile
+import time
 from io import BytesIO
+from pathlib import Path
 
 # === PAGINA CONFIG ===
 st.set_page_config(layout="wide", page_title="VEZC Urenadministratie", page_icon="✈️")
@@ -16,31 +23,205 @@ colors = [
     '#98FB98', '#9862FB', '#FFD700', '#007AFF',
     '#FF6347', '#477AFF', '#87CEEB', '#EB87CE'
 ]
+COLOR_CYCLE = np.array(colors, dtype=object)
+
+def cycle_colors(n):
+    return np.take(COLOR_CYCLE, np.arange(n), mode='wrap')
+
+# === PARQUET CACHE ===
+# Een eenmaal ingelezen Excel wordt als parquet bewaard, zodat hetzelfde bestand
+# na een herstart of cache-eviction niet opnieuw geparsed hoeft te worden.
+# Verhoog CACHE_VERSION wanneer parse_excel andere kolommen of dtypes oplevert.
+# De cache bevat kopieën van geüploade ledengegevens; bestanden ouder dan
+# CACHE_MAX_AGE_DAYS worden bij het inlezen van een nieuw bestand opgeruimd.
+# De map hangt aan de map van dit script, niet aan de werkmap van het proces
+# (anders belandt de cache bij `streamlit run` vanuit $HOME in ~/.cache).
+CACHE_DIR = Path(__file__).resolve().parent / '.cache'
+CACHE_VERSION = 1
+CACHE_MAX_AGE_DAYS = 7
+
+# === PERFORMANCE ===
+# De zware onderdelen van deze app zijn geheugen-gebonden: het inlezen van de xlsx
+# en kolomscans (groupby, value_counts, isin). Daar helpen gevectoriseerde pandas/
+# Arrow-kernels en een compacte datalayout (categoricals), niet SIMD of GPU.
+# Komt er ooit een eigen aggregatie die per rij in Python zou lopen, schrijf die dan
+# als numba-kernel over .to_numpy() arrays, naar het voorbeeld hieronder.
+# Geen cache=True: dan faalt het laden van home.py als __pycache__ en ~/.cache/numba
+# niet schrijfbaar zijn, en de app moet ook op een alleen-lezen omgeving starten.
+@njit(cache=False)
+def _njit_groupby_sum(codes, values, ngroups):
+    # codes: categorie-codes (-1 = ontbrekend), values: float-array van dezelfde lengte
+    out = np.zeros(ngroups, dtype=np.float64)
+    for i in range(codes.size):
+        code = codes[i]
+        if code >= 0 and not np.isnan(values[i]):
+            out[code] += values[i]
+    return out
 
 # === FUNCTIES ===
+# De grafiek met laatste vluchten toont alleen de recentst gevlogen types;
+# de volledige tabel staat in een expander.
+MAX_LAST_FLIGHT_BARS = 20
+# Het tabeloverzicht van de gefilterde data toont maximaal zoveel rijen; de rest
+# blijft beschikbaar via de Excel-download.
+MAX_PREVIEW_ROWS = 500
+
+def remove_cache_file(path):
+    try:
+        path.unlink(missing_ok=True)
+    except OSError:
+        pass
+
+def prune_cache():
+    cutoff = time.time() - CACHE_MAX_AGE_DAYS * 24 * 3600
+    # Alleen eigen bestanden opruimen: cache-parquets en achtergebleven tijdelijke bestanden.
+    paths = itertools.chain(CACHE_DIR.glob('*-v*.parquet'), CACHE_DIR.glob('*.tmp'))
+    for path in paths:
+        try:
+            expired = path.stat().st_mtime < cutoff
+        except OSError:
+            continue
+        if expired:
+            remove_cache_file(path)
+
 @st.cache_data
-def load_data(file):
-    df = pd.read_excel(file)
+def load_data(file_key, _file):
+    prune_cache()
+    cache_path = CACHE_DIR / f"{file_key}-v{CACHE_VERSION}.parquet"
+    if cache_path.exists():
+        try:
+            return pd.read_parquet(cache_path)
+        except (OSError, ValueError):
+            # Beschadigd of half geschreven cachebestand: weggooien en opnieuw parsen.
+            remove_cache_file(cache_path)
+
+    df = parse_excel(_file)
+    tmp_path = None
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        # Unieke tijdelijke naam, zodat gelijktijdige sessies elkaars bestand niet overschrijven.
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix='.tmp', delete=False) as tmp:
+            tmp_path = Path(tmp.name)
+        df.to_parquet(tmp_path, compression='zstd')
+        tmp_path.replace(cache_path)
+    except (OSError, ValueError, TypeError):
+        # Niet-schrijfbare map of kolommen die Arrow niet kan opslaan: dan zonder cache verder.
+        if tmp_path is not None:
+            remove_cache_file(tmp_path)
+    return df
+
+def parse_excel(file):
+    df = pd.read_excel(file, engine='calamine')
     df['Datum'] = pd.to_datetime(df['Datum'], errors='coerce', dayfirst=True)
     df['Vluchtduur'] = pd.to_timedelta(df['Vluchtduur'], errors='coerce').dt.total_seconds() / 3600
+    for col in ['Veld', 'Type', 'Registratie', 'Startmethode']:
+        if col in df.columns:
+            # Een kolom met getallen en tekst door elkaar (bv. Registratie 1234 en 'PH-1')
+            # wordt helemaal tekst: categorieën van één type kan Arrow wel omzetten.
+            if pd.api.types.infer_dtype(df[col], skipna=True) in ('mixed', 'mixed-integer'):
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+            df[col] = df[col].astype('category')
     return df
 
 def filter_dataframe(df, veld, type_, registratie, startmethode, start, end):
-    mask = pd.Series([True] * len(df))
-    if veld: mask &= df['Veld'].isin(veld)
-    if type_: mask &= df['Type'].isin(type_)
-    if registratie: mask &= df['Registratie'].isin(registratie)
-    if startmethode: mask &= df['Startmethode'].isin(startmethode)
-    if start: mask &= df['Datum'] >= pd.to_datetime(start)
-    if end: mask &= df['Datum'] <= pd.to_datetime(end)
+    mask = np.ones(len(df), dtype=bool)
+    if veld: mask &= df['Veld'].isin(set(veld)).to_numpy()
+    if type_: mask &= df['Type'].isin(set(type_)).to_numpy()
+    if registratie: mask &= df['Registratie'].isin(set(registratie)).to_numpy()
+    if startmethode: mask &= df['Startmethode'].isin(set(startmethode)).to_numpy()
+    if start is not None: mask &= df['Datum'].to_numpy() >= start
+    if end is not None: mask &= df['Datum'].to_numpy() <= end
     return df[mask]
 
-def to_excel_download(df):
+# Aggregaties worden gecached op de hash van het bestand (en de filterselectie),
+# zodat een rerun zonder gewijzigde filters geen groupby meer uitvoert.
+@st.cache_data
+def compute_last_flights(file_key, today, _df):
+    last_flights = _df.groupby('Type', observed=True)['Datum'].max().dropna().reset_index()
+    datum_days = last_flights['Datum'].to_numpy().astype('datetime64[D]')
+    last_flights['Dagen geleden'] = (today - datum_days).astype('int32')
+    # Datum blijft een datetime-kolom; de weergave als dd-mm-jjjj gebeurt in de browser.
+    table = (last_flights[['Type', 'Datum', 'Dagen geleden']]
+             .rename(columns={'Datum': 'Laatste vlucht'})
+             .sort_values("Dagen geleden"))
+    return table.head(MAX_LAST_FLIGHT_BARS), table
+
+# Coördinaten in dezelfde volgorde als de Veld-categorieën: de koppeling aan de
+# tellingen per code is dan een positionele selectie in plaats van een join.
+@st.cache_data
+def veld_coords_by_code(file_key, _categories):
+    return VELD_COORDS_DF.reindex(_categories)
+
+@st.cache_data(show_spinner=False)
+def compute_aggs(file_key, filters, _filtered_df):
+    by_type = _filtered_df.groupby('Type', sort=False, observed=True).agg(starts=('Vluchtduur', 'size'), hours=('Vluchtduur', 'sum'))
+    veld = _filtered_df['Veld'].cat
+    codes = veld.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(veld.categories))
+    coords = veld_coords_by_code(file_key, veld.categories)
+    keep = (counts > 0) & coords['lat'].notna().to_numpy()
+    veld_counts = coords[keep].assign(**{'Aantal starts': counts[keep]}).reset_index(names='Veld')
+    # Straal voor de kaart: schaalt met de wortel, zodat het oppervlak evenredig is met het aantal starts.
+    veld_counts['radius'] = np.sqrt(veld_counts['Aantal starts']) * 300
+    return {
+        'starts_per_type': by_type['starts'].sort_values(ascending=False),
+        'hours_per_type': by_type['hours'].sort_values(ascending=False),
+        'veld_counts': veld_counts,
+    }
+
+@st.cache_data
+def unique_options(file_key, _df):
+    return {col: _df[col].cat.categories.tolist() for col in ['Veld', 'Type', 'Registratie', 'Startmethode']}
+
+# Arrow-tabellen zijn immutable en kunnen dus zonder kopie gedeeld worden (cache_resource).
+# st.dataframe serialiseert de tabel nog steeds bij elke rerun; dit bespaart alleen de
+# from_pandas-conversie van de (maximaal MAX_PREVIEW_ROWS) voorbeeldrijen.
+# Kolommen met gemengde getallen en tekst kan Arrow niet direct omzetten; geef dan het
+# pandas-frame door, zodat st.dataframe zijn eigen fallback voor zulke kolommen toepast.
+@st.cache_resource(max_entries=32)
+def to_arrow_preview(file_key, filters, _df):
+    preview = _df.head(MAX_PREVIEW_ROWS)
+    try:
+        return pa.Table.from_pandas(preview, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return preview
+
+# Elke filtercombinatie levert een volledig xlsx-bestand op; begrens de cache
+# zodat oude exports niet onbeperkt geheugen vasthouden.
+@st.cache_data(max_entries=16, ttl=3600)
+def to_excel_download(file_key, filters, _df):
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        _df.to_excel(writer, index=False)
     return output.getvalue()
 
+# Figuren blijven per sessie bestaan; bij een rerun worden alleen de data-arrays
+# vervangen. Met een vaste uirevision diffed Plotly de grafiek (Plotly.react)
+# in plaats van hem opnieuw op te bouwen, en blijven zoom/selectie behouden.
+def update_figure(chart_id, trace_type, layout, **trace):
+    fig = st.session_state.get(chart_id)
+    if fig is None:
+        fig = go.Figure(data=[trace_type()], layout=layout)
+        fig.update_layout(uirevision=chart_id)
+        st.session_state[chart_id] = fig
+    fig.data[0].update(**trace)
+    return fig
+
+# Zelfde idee voor de kaart: de Deck blijft per sessie bestaan en alleen de data
+# van de ScatterplotLayer wordt vervangen. De straal komt kant-en-klaar uit compute_aggs.
+def update_veld_map(veld_counts):
+    deck = st.session_state.get('veld_map')
+    if deck is None:
+        layer = pdk.Layer('ScatterplotLayer', veld_counts, get_position='[lon, lat]', get_radius='radius',
+                          get_fill_color=[0, 92, 159, 160], radius_min_pixels=4, pickable=True)
+        view_state = pdk.ViewState(latitude=veld_counts['lat'].mean(), longitude=veld_counts['lon'].mean(), zoom=6)
+        deck = pdk.Deck(layers=[layer], initial_view_state=view_state, map_style=None,
+                        tooltip={'text': '{Veld}: {Aantal starts} starts'})
+        st.session_state['veld_map'] = deck
+    else:
+        deck.layers[0].data = veld_counts
+    return deck
+
 # === COORDINATEN PER VELD ===
 veld_coords = {
     'Venlo': (51.387, 6.156),
@@ -59,6 +240,7 @@ veld_coords = {
     'Stadlohn': (51.9921, 6.9138),
     'Stendal': (52.6041, 11.8518)
 }
+VELD_COORDS_DF = pd.DataFrame.from_dict(veld_coords, orient='index', columns=['lat', 'lon'])
 
 # === HEADER ===
 st.title("✈️ Venlo Eindhoven ZweefvliegClub Vluchtadministratie")
@@ -97,7 +279,8 @@ with st.expander("ℹ️ Wat doet deze tool precies?"):
 uploaded_file = st.file_uploader("📁 Upload hier je Startadministratie in Excel-formaat", type=['xlsx'])
 
 if uploaded_file:
-    df = load_data(uploaded_file)
+    file_key = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+    df = load_data(file_key, uploaded_file)
 
     # VALIDATIE
     expected_columns = {'Datum', 'Veld', 'Type', 'Registratie', 'Startmethode', 'Vluchtduur'}
@@ -111,103 +294,125 @@ else:
 
 # === SIDEBAR ===
 st.sidebar.title("📊 Filters")
-selected_veld = st.sidebar.multiselect("Veld", df['Veld'].dropna().unique())
-selected_type = st.sidebar.multiselect("Type", df['Type'].dropna().unique())
-selected_registratie = st.sidebar.multiselect("Registratie", df['Registratie'].dropna().unique())
-selected_startmethode = st.sidebar.multiselect("Startmethode", df['Startmethode'].dropna().unique())
+options = unique_options(file_key, df)
+selected_veld = st.sidebar.multiselect("Veld", options['Veld'])
+selected_type = st.sidebar.multiselect("Type", options['Type'])
+selected_registratie = st.sidebar.multiselect("Registratie", options['Registratie'])
+selected_startmethode = st.sidebar.multiselect("Startmethode", options['Startmethode'])
 selected_start_date = st.sidebar.date_input("Startdatum (van)", None)
 selected_end_date = st.sidebar.date_input("Einddatum (t/m)", None)
 
 # === FILTEREN ===
-filtered_df = filter_dataframe(df, selected_veld, selected_type, selected_registratie, selected_startmethode, selected_start_date, selected_end_date)
+start_np = np.datetime64(selected_start_date) if selected_start_date else None
+end_np = np.datetime64(selected_end_date) if selected_end_date else None
+filtered_df = filter_dataframe(df, selected_veld, selected_type, selected_registratie, selected_startmethode, start_np, end_np)
+filters = (tuple(sorted(selected_veld)), tuple(sorted(selected_type)), tuple(sorted(selected_registratie)),
+           tuple(sorted(selected_startmethode)), selected_start_date, selected_end_date)
+
+# === DASHBOARD ===
+# Het dashboard bestaat uit losse fragmenten: een interactie binnen één onderdeel
+# (zoals de downloadknop) herlaadt alleen dat onderdeel en niet upload, header,
+# sidebar of de andere grafieken. De sidebar-widgets zelf kunnen in Streamlit 1.33
+# niet binnen een fragment staan.
+@st.experimental_fragment
+def render_type_panels(file_key, filtered_df, filters):
+    st.info(f"🔎 {len(filtered_df)} vluchten gevonden.")
+
+    # === DOWNLOAD KNOP ===
+    st.download_button(
+        label="⬇️ Download gefilterde data als Excel",
+        data=to_excel_download(file_key, filters, filtered_df),
+        file_name="vezc_uren_filtered.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
 
-st.info(f"🔎 {len(filtered_df)} vluchten gevonden.")
-
-# === DOWNLOAD KNOP ===
-st.download_button(
-    label="⬇️ Download gefilterde data als Excel",
-    data=to_excel_download(filtered_df),
-    file_name="vezc_uren_filtered.xlsx",
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-)
+    st.markdown("---")
 
-st.markdown("---")
+    # === VISUALISATIES ===
+    col1, col2, col3 = st.columns(3)
 
-# === VISUALISATIES ===
-col1, col2, col3 = st.columns(3)
+    if not len(filtered_df):
+        return
 
-if not filtered_df.empty:
-    starts_per_type = filtered_df['Type'].value_counts()
-    hours_per_type = filtered_df.groupby('Type')['Vluchtduur'].sum().sort_values(ascending=False)
+    aggs = compute_aggs(file_key, filters, filtered_df)
+    starts_per_type = aggs['starts_per_type']
+    hours_per_type = aggs['hours_per_type']
 
     # === COL1: TABEL DATA ===
     with col1:
         st.subheader("🛫 Starts")
-        st.dataframe(starts_per_type.rename("Aantal starts").reset_index().rename(columns={'index': 'Type'}), width=600, hide_index=True)
+        st.dataframe(pd.DataFrame({'Type': starts_per_type.index, 'Aantal starts': starts_per_type.values}), width=600, hide_index=True)
         st.markdown(f"**Totaal starts**: {int(starts_per_type.sum())} starts")
-    with col1:
+
         st.subheader("🕒 Vlieguren")
-        st.dataframe(hours_per_type.rename("Vlieguren").reset_index(), width=600, hide_index=True)
+        st.dataframe(pd.DataFrame({'Type': hours_per_type.index, 'Vlieguren': hours_per_type.values}), width=600, hide_index=True,
+                     column_config={'Vlieguren': st.column_config.NumberColumn(format="%.2f")})
         st.markdown(f"**Totaal uren**: {round(hours_per_type.sum(), 2)} uur")
 
     # === COL2: BAR CHARTS ===
     with col2:
-        fig1 = go.Figure([go.Bar(x=starts_per_type.index, y=starts_per_type.values,
-                                 marker_color=[colors[i % len(colors)] for i in range(len(starts_per_type))])])
-        fig1.update_layout(title="Aantal starts per vliegtuigtype", xaxis_title="Type", yaxis_title="Aantal")
+        fig1 = update_figure('fig_starts_bar', go.Bar,
+                             dict(title="Aantal starts per vliegtuigtype", xaxis_title="Type", yaxis_title="Aantal"),
+                             x=starts_per_type.index, y=starts_per_type.values,
+                             marker_color=cycle_colors(len(starts_per_type)))
         st.plotly_chart(fig1, use_container_width=True)
 
-        fig2 = go.Figure([go.Bar(x=hours_per_type.index, y=hours_per_type.values,
-                                 marker_color=[colors[i % len(colors)] for i in range(len(hours_per_type))])])
-        fig2.update_layout(title="Aantal vlieguren per vliegtuigtype", xaxis_title="Type", yaxis_title="Uren")
+        fig2 = update_figure('fig_hours_bar', go.Bar,
+                             dict(title="Aantal vlieguren per vliegtuigtype", xaxis_title="Type", yaxis_title="Uren"),
+                             x=hours_per_type.index, y=hours_per_type.values,
+                             marker_color=cycle_colors(len(hours_per_type)),
+                             hovertemplate="%{x}: %{y:,.2f} uur<extra></extra>")
         st.plotly_chart(fig2, use_container_width=True)
 
     # === COL3: PIE CHARTS ===
     with col3:
-        fig3 = go.Figure(data=[go.Pie(labels=starts_per_type.index, values=starts_per_type.values,
-                                      marker_colors=[colors[i % len(colors)] for i in range(len(starts_per_type))],
-                                      textinfo='percent+label')])
-        fig3.update_layout(title="Verdeling starts")
+        fig3 = update_figure('fig_starts_pie', go.Pie, dict(title="Verdeling starts", piecolorway=colors),
+                             labels=starts_per_type.index, values=starts_per_type.values,
+                             textinfo='percent+label', sort=False)
         st.plotly_chart(fig3, use_container_width=True)
 
         if not hours_per_type.empty:
-            fig4 = go.Figure(data=[go.Pie(labels=hours_per_type.index, values=hours_per_type.values,
-                                          marker_colors=[colors[i % len(colors)] for i in range(len(hours_per_type))],
-                                          textinfo='percent+label')])
-            fig4.update_layout(title="Verdeling vlieguren")
+            fig4 = update_figure('fig_hours_pie', go.Pie, dict(title="Verdeling vlieguren", piecolorway=colors),
+                                 labels=hours_per_type.index, values=hours_per_type.values,
+                                 textinfo='percent+label', sort=False)
             st.plotly_chart(fig4, use_container_width=True)
 
-    # === LAATSTE VLUCHTEN ===
+# Hangt alleen af van de volledige dataset, niet van de filters.
+@st.experimental_fragment
+def render_last_flights(file_key, df):
     st.markdown("---")
     st.subheader("🛬 Laatste vluchten per vliegtuigtype")
 
-    df['Datum'] = pd.to_datetime(df['Datum'], errors='coerce')
-    today = pd.Timestamp.now().normalize()
-    last_flights = df.groupby('Type')['Datum'].max().reset_index()
-    last_flights['Laatste vlucht'] = last_flights['Datum'].dt.strftime('%d-%m-%Y')
-    last_flights['Dagen geleden'] = (today - last_flights['Datum']).dt.days
-    st.dataframe(last_flights[['Type', 'Laatste vlucht', 'Dagen geleden']].sort_values("Dagen geleden"), hide_index=True)
+    today = np.datetime64('today', 'D')
+    top_flights, last_flights_table = compute_last_flights(file_key, today, df)
 
-    fig5 = go.Figure([go.Bar(x=last_flights['Type'], y=last_flights['Dagen geleden'],
-                             marker_color=colors[0])])
-    fig5.update_layout(title="Dagen geleden sinds laatste vlucht per type", xaxis_title="Type", yaxis_title="Dagen geleden")
+    fig5 = update_figure('fig_last_flights', go.Bar,
+                         dict(title="Dagen geleden sinds laatste vlucht per type", xaxis_title="Type", yaxis_title="Dagen geleden"),
+                         x=top_flights['Type'], y=top_flights['Dagen geleden'], marker_color=colors[0])
     st.plotly_chart(fig5, use_container_width=True)
 
-    # === KAART ===
+    with st.expander("📋 Bekijk alle types"):
+        st.dataframe(last_flights_table, hide_index=True,
+                     column_config={'Laatste vlucht': st.column_config.DateColumn(format="DD-MM-YYYY")})
+
+@st.experimental_fragment
+def render_map(file_key, filtered_df, filters):
     st.markdown("---")
     st.subheader("🗺️ Kaart: Starts per veld")
 
-    veld_counts = filtered_df['Veld'].value_counts().reset_index()
-    veld_counts.columns = ['Veld', 'Aantal starts']
-    veld_counts['Latitude'] = veld_counts['Veld'].map(lambda x: veld_coords.get(x, (np.nan, np.nan))[0])
-    veld_counts['Longitude'] = veld_counts['Veld'].map(lambda x: veld_coords.get(x, (np.nan, np.nan))[1])
-    veld_counts = veld_counts.dropna(subset=['Latitude', 'Longitude'])
-
-    st.map(veld_counts.rename(columns={'Latitude': 'lat', 'Longitude': 'lon'}))
+    veld_counts = compute_aggs(file_key, filters, filtered_df)['veld_counts']
+    if not veld_counts.empty:
+        st.pydeck_chart(update_veld_map(veld_counts), use_container_width=True)
 
     # === GEHELE DATA ===
     with st.expander("📋 Bekijk volledige gefilterde data"):
-        st.dataframe(filtered_df, hide_index=True)
-
+        st.dataframe(to_arrow_preview(file_key, filters, filtered_df), hide_index=True)
+        if len(filtered_df) > MAX_PREVIEW_ROWS:
+            st.caption(f"Eerste {MAX_PREVIEW_ROWS} van {len(filtered_df)} vluchten; download de Excel voor alle rijen.")
+
+render_type_panels(file_key, filtered_df, filters)
+if len(filtered_df):
+    render_last_flights(file_key, df)
+    render_map(file_key, filtered_df, filters)
 else:
     st.warning("⚠️ Geen resultaten met deze filters. Pas je selectie aan.")